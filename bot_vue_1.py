@@ -1,6 +1,22 @@
 import os
+import json
+import hashlib
+import time
+import sqlite3
+import random
+import threading
+import functools
+import multiprocessing
+import difflib
+from collections import OrderedDict, Counter, deque
+from itertools import islice
+from queue import Empty
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import urlparse, parse_qs, parse_qsl, urlencode
 import discord
 from discord.ext import commands
+from discord.oggparse import OggStream
 import yt_dlp as youtube_dl
 import asyncio
 from dotenv import load_dotenv
@@ -13,16 +29,115 @@ TOKEN = os.getenv("TOKEN")
 SPOTIFY_CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
 SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
 
+# Cache des résolutions yt-dlp
+CACHE_DIR = os.getenv("CACHE_DIR", "cache")
+RESOLVER_CACHE_SIZE = int(os.getenv("RESOLVER_CACHE_SIZE", "512"))
+RESOLVER_CACHE_TTL = int(os.getenv("RESOLVER_CACHE_TTL", "21600"))
+RESOLVER_CACHE_DISK = os.getenv("RESOLVER_CACHE_DISK", "1") == "1"
+
+# Correspondances Spotify → YouTube réutilisées au-dessus de ce score
+MATCH_MIN_CONFIDENCE = float(os.getenv("MATCH_MIN_CONFIDENCE", "0.6"))
+
+# "opus" : ffmpeg sort directement de l'Opus (copie du flux quand c'est possible)
+# "pcm" : décodage en PCM puis volume et encodage Opus côté Python
+PLAYBACK_MODE = os.getenv("PLAYBACK_MODE", "opus").lower()
+OPUS_BITRATE = int(os.getenv("OPUS_BITRATE", "128"))
+# Débit visé (kbps) quand celui du salon vocal est inconnu
+DEFAULT_TARGET_KBPS = int(os.getenv("DEFAULT_TARGET_KBPS", "96"))
+
+# Workers réservés à yt-dlp : "thread" ou "process" (hors du GIL des envois audio)
+EXTRACT_BACKEND = os.getenv("EXTRACT_BACKEND", "thread").lower()
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", "4"))
+# Lien extrait une fois par processus au démarrage (facultatif)
+EXTRACT_WARMUP_URL = os.getenv("EXTRACT_WARMUP_URL")
+
+# Cache audio local (désactivé par défaut)
+AUDIO_CACHE = os.getenv("AUDIO_CACHE", "0") == "1"
+AUDIO_CACHE_MAX_MB = int(os.getenv("AUDIO_CACHE_MAX_MB", "2048"))
+# Les pistes plus longues (mix, directs...) ne sont pas mises en cache
+AUDIO_CACHE_MAX_TRACK_SECONDS = int(os.getenv("AUDIO_CACHE_MAX_TRACK_SECONDS", "900"))
+
+# Nombre de pistes résolues à l'avance pendant la lecture
+PREFETCH_AHEAD = int(os.getenv("PREFETCH_AHEAD", "2"))
+# Après un échec de lecture, nombre de pistes suivantes résolues en parallèle
+SKIP_AHEAD_PARALLEL = int(os.getenv("SKIP_AHEAD_PARALLEL", "3"))
+# Résultats de recherche essayés quand le premier résultat d'une piste Spotify est illisible
+SEARCH_FALLBACK_RESULTS = int(os.getenv("SEARCH_FALLBACK_RESULTS", "3"))
+
+# Message "Lecture en cours" : rafraîchissement de la barre de progression (0 = seulement aux
+# changements de piste ou de pause, sinon au moins NOW_PLAYING_MIN_REFRESH) et délai de regroupement (secondes)
+NOW_PLAYING_REFRESH = int(os.getenv("NOW_PLAYING_REFRESH", "0"))
+NOW_PLAYING_MIN_REFRESH = 60
+NOW_PLAYING_DEBOUNCE = float(os.getenv("NOW_PLAYING_DEBOUNCE", "3"))
+
+# Messages en attente par salon avant d'abandonner les plus anciennes notifications
+OUTBOX_MAX_PENDING = int(os.getenv("OUTBOX_MAX_PENDING", "20"))
+
+# Sharding : un nombre de shards ou "auto" (nombre conseillé par Discord), vide = une seule connexion
+SHARD_COUNT = os.getenv("SHARD_COUNT")
+# Shards gérés par ce processus : "0-3" ou "0,2,4" (par défaut tous)
+SHARD_IDS = os.getenv("SHARD_IDS")
+
+# Déconnexion automatique (secondes, 0 = jamais) : rien à jouer / plus personne dans le salon vocal /
+# lecture en pause (bien plus long : la file est perdue à la déconnexion)
+IDLE_TIMEOUT = int(os.getenv("IDLE_TIMEOUT", "300"))
+EMPTY_CHANNEL_TIMEOUT = int(os.getenv("EMPTY_CHANNEL_TIMEOUT", "60"))
+PAUSE_TIMEOUT = int(os.getenv("PAUSE_TIMEOUT", "3600"))
+# Nombre maximum de lecteurs en mémoire (0 = illimité)
+MAX_PLAYERS = int(os.getenv("MAX_PLAYERS", "0"))
+# Intervalle du nettoyage des lecteurs sans connexion vocale
+PLAYER_SWEEP_INTERVAL = int(os.getenv("PLAYER_SWEEP_INTERVAL", "60"))
+
+# Files sauvegardées pour survivre à un redémarrage : "auto" (reprise directe),
+# "offer" (bouton proposé dans le salon) ou "off" ; intervalle de sauvegarde en secondes
+RESTORE_QUEUES = os.getenv("RESTORE_QUEUES", "offer").lower()
+SNAPSHOT_INTERVAL = int(os.getenv("SNAPSHOT_INTERVAL", "15"))
+
+# Mode cluster : groupes de shards répartis sur plusieurs processus (1 = désactivé)
+CLUSTER_PROCESSES = int(os.getenv("CLUSTER_PROCESSES", "1"))
+# Rempli par le lanceur pour chaque processus du cluster
+CLUSTER_ID = int(os.getenv("CLUSTER_ID")) if os.getenv("CLUSTER_ID") else None
+CLUSTER_REPORT_INTERVAL = int(os.getenv("CLUSTER_REPORT_INTERVAL", "15"))
+# Un processus silencieux plus longtemps est considéré bloqué et relancé
+CLUSTER_HEARTBEAT_TIMEOUT = int(os.getenv("CLUSTER_HEARTBEAT_TIMEOUT", "120"))
+# Attente par shard entre deux démarrages (limite d'identification de Discord)
+CLUSTER_START_DELAY = float(os.getenv("CLUSTER_START_DELAY", "5"))
+
 if not TOKEN:
     raise ValueError("❌ Aucun TOKEN trouvé dans .env !")
 
+def parse_shard_ids(value):
+    if not value:
+        return None
+    ids = []
+    for part in value.split(","):
+        start, _, end = part.strip().partition("-")
+        ids.extend(range(int(start), int(end or start) + 1))
+    return sorted(set(ids))
+
+if SHARD_IDS and not (SHARD_COUNT or "").isdigit():
+    raise ValueError("❌ SHARD_IDS demande un SHARD_COUNT numérique !")
+
 # Spotify client
+# Un seul client partagé : une session HTTP réutilisée et un seul jeton en cache,
+# créé au premier appel (les workers d'extraction réimportent ce fichier)
 sp = None
-if SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET:
-    sp = spotipy.Spotify(auth_manager=SpotifyClientCredentials(
-        client_id=SPOTIFY_CLIENT_ID,
-        client_secret=SPOTIFY_CLIENT_SECRET
-    ))
+
+def spotify_client():
+    global sp
+    if sp is None and SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET:
+        sp = spotipy.Spotify(auth_manager=SpotifyClientCredentials(
+            client_id=SPOTIFY_CLIENT_ID,
+            client_secret=SPOTIFY_CLIENT_SECRET
+        ))
+    return sp
+
+# spotipy est bloquant (requests) : ses appels passent par des threads dédiés
+spotify_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="spotify")
+
+async def spotify_call(fn, *args, **kwargs):
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(spotify_executor, functools.partial(fn, *args, **kwargs))
 
 # Intents
 intents = discord.Intents.default()
@@ -30,7 +145,23 @@ intents.message_content = True
 intents.voice_states = True
 intents.guilds = True
 
-bot = commands.Bot(command_prefix="!", intents=intents)
+# Statut envoyé à la connexion de chaque shard
+activity = discord.Activity(
+    type=discord.ActivityType.listening,
+    name="DJ Twahlett 🎧"
+)
+
+if SHARD_COUNT:
+    # Un serveur appartient à un seul shard : le dictionnaire players reste commun au processus
+    bot = commands.AutoShardedBot(
+        command_prefix="!",
+        intents=intents,
+        activity=activity,
+        shard_count=int(SHARD_COUNT) if SHARD_COUNT.isdigit() else None,
+        shard_ids=parse_shard_ids(SHARD_IDS)
+    )
+else:
+    bot = commands.Bot(command_prefix="!", intents=intents, activity=activity)
 bot.remove_command("help")
 
 # yt-dlp options
@@ -43,7 +174,117 @@ ytdl_format_options = {
     'geo_bypass': True,
     'ignoreerrors': True,
 }
-ytdl = youtube_dl.YoutubeDL(ytdl_format_options)
+
+# flat : liste les entrées d'une playlist sans les résoudre
+def _extract_trimmed(ytdl, query, flat=False):
+    start = time.monotonic()
+    if flat:
+        data = trim_entries(ytdl.extract_info(query, download=False, process=False))
+    else:
+        data = trim_info(ytdl.extract_info(query, download=False))
+    return time.monotonic() - start, data
+
+# Processus d'extraction : une instance YoutubeDL par processus, préparée au lancement
+_process_ytdl = None
+
+def _extraction_worker_init(options):
+    global _process_ytdl
+    _process_ytdl = youtube_dl.YoutubeDL(options)
+    try:
+        for key in ("Youtube", "YoutubeSearch", "Soundcloud"):
+            _process_ytdl.get_info_extractor(key)
+        if EXTRACT_WARMUP_URL:
+            _process_ytdl.extract_info(EXTRACT_WARMUP_URL, download=False)
+    except Exception as e:
+        # Le worker reste utilisable, seule la première extraction sera plus lente
+        print(f"⚠️ Préchauffage de l'extraction impossible (pid {os.getpid()}) : {e}")
+
+def _extraction_worker_ping():
+    return os.getpid()
+
+def _extraction_worker_run(query, flat=False):
+    return _extract_trimmed(_process_ytdl, query, flat)
+
+# Pool dédié à l'extraction : chaque worker a sa propre instance YoutubeDL
+class ExtractionPool:
+    def __init__(self, workers, backend="thread"):
+        self.workers = workers
+        self.backend = backend
+        self.executor = None
+        self.local = threading.local()
+        self.inflight = 0
+        self.done = 0
+        self.busy_time = 0.0
+        self.started = time.monotonic()
+
+    # Crée les workers ; en mode processus, ils sont lancés et préchauffés tout de suite
+    def start(self):
+        if self.executor is not None:
+            return
+        if self.backend == "process":
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_extraction_worker_init,
+                initargs=(ytdl_format_options,),
+            )
+            for _ in range(self.workers):
+                self.executor.submit(_extraction_worker_ping)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ytdl")
+
+    # Les extractions concurrentes échouent ensemble : seul le premier recrée le pool
+    def restart(self, broken):
+        if self.executor is not broken:
+            return
+        print("⚠️ Pool d'extraction cassé, redémarrage des workers")
+        broken.shutdown(wait=False, cancel_futures=True)
+        self.executor = None
+        self.start()
+
+    def ytdl(self):
+        instance = getattr(self.local, "ytdl", None)
+        if instance is None:
+            instance = self.local.ytdl = youtube_dl.YoutubeDL(ytdl_format_options)
+        return instance
+
+    # Renvoie le résultat yt-dlp déjà réduit aux champs utiles
+    async def extract(self, query, *, flat=False, loop=None):
+        loop = loop or asyncio.get_event_loop()
+        self.start()
+        self.inflight += 1
+        try:
+            if self.backend == "process":
+                executor = self.executor
+                try:
+                    elapsed, data = await loop.run_in_executor(executor, _extraction_worker_run, query, flat)
+                except BrokenProcessPool:
+                    # Un worker est mort (OOM, crash natif) : pool recréé puis un seul nouvel essai
+                    self.restart(executor)
+                    elapsed, data = await loop.run_in_executor(self.executor, _extraction_worker_run, query, flat)
+            else:
+                elapsed, data = await loop.run_in_executor(
+                    self.executor, lambda: _extract_trimmed(self.ytdl(), query, flat)
+                )
+        finally:
+            self.inflight -= 1
+        self.done += 1
+        self.busy_time += elapsed
+        return data
+
+    def stats(self):
+        uptime = max(time.monotonic() - self.started, 1e-6)
+        active = min(self.inflight, self.workers)
+        return {
+            "backend": self.backend,
+            "workers": self.workers,
+            "queued": self.inflight - active,
+            "active": active,
+            "done": self.done,
+            "utilization": self.busy_time / (uptime * self.workers),
+        }
+
+extraction_pool = ExtractionPool(EXTRACT_WORKERS, EXTRACT_BACKEND)
 
 def find_ffmpeg():
     local_path = os.path.join(os.getcwd(), "bin", "ffmpeg.exe")
@@ -51,51 +292,523 @@ def find_ffmpeg():
         return local_path
     return "ffmpeg"
 
-# Classe YTDLSource
-class YTDLSource(discord.PCMVolumeTransformer):
-    def __init__(self, source, *, data, volume=1.0):
-        super().__init__(source, volume)
-        self.data = data
-        self.title = data.get("title")
+FFMPEG_BEFORE_OPTIONS = "-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5 -nostdin"
+
+# Paramètres d'URL qui ne changent pas la piste
+TRACKING_PARAMS = {"si", "feature", "pp", "ab_channel", "utm_source", "utm_medium", "utm_campaign"}
+# Marge avant l'expiration d'une URL signée
+STREAM_EXPIRY_MARGIN = 300
+# Entrées expirées supprimées de la base toutes les N écritures
+RESOLVER_CACHE_PURGE_EVERY = 200
+
+def normalize_query(query: str) -> str:
+    query = query.strip()
+    if not query.startswith(("http://", "https://")):
+        return " ".join(query.lower().split())
+
+    parsed = urlparse(query)
+    host = parsed.netloc.lower().removeprefix("www.").removeprefix("m.")
+    if host == "youtu.be":
+        return f"youtube.com/watch?v={parsed.path.strip('/')}"
+    if host in ("youtube.com", "music.youtube.com") and parsed.path == "/watch":
+        video_id = parse_qs(parsed.query).get("v", [""])[0]
+        return f"youtube.com/watch?v={video_id}"
+
+    params = [(k, v) for k, v in parse_qsl(parsed.query) if k not in TRACKING_PARAMS]
+    normalized = host + parsed.path.rstrip("/")
+    if params:
+        normalized += "?" + urlencode(params)
+    return normalized
+
+# Ordre de préférence : audio seul en Opus, audio seul autre codec, puis formats
+# avec vidéo en dernier recours ; à niveau égal, le débit le plus proche
+# au-dessus de celui du salon vocal
+def format_rank(f, target_kbps):
+    vcodec = f.get('vcodec')
+    if vcodec == 'none':
+        tier = 0 if f.get('acodec') == 'opus' else 1
+    else:
+        tier = 2 if vcodec is None else 3
+    abr = f.get('abr') or 0
+    return tier, abr < target_kbps, abs(abr - target_kbps)
+
+# SoundCloud : le coût de démarrage passe avant le codec.
+# Progressif (un seul GET) < HLS Opus < autre HLS (segments + rechargement de la playlist)
+def soundcloud_format_rank(f, target_kbps):
+    hls = (f.get('protocol') or '').startswith('m3u8')
+    transport = (1 if f.get('acodec') == 'opus' else 2) if hls else 0
+    abr = f.get('abr') or 0
+    return transport, abr < target_kbps, abs(abr - target_kbps)
+
+def pick_audio_format(data, target_kbps=None):
+    if not data.get('formats'):
+        return data
+    formats = [f for f in data['formats'] if f.get('acodec') != 'none' and f.get('url')]
+    if not formats:
+        return None
+    target = target_kbps or DEFAULT_TARGET_KBPS
+    rank = soundcloud_format_rank if data.get('extractor_key') == 'Soundcloud' else format_rank
+    return min(formats, key=lambda f: rank(f, target))
+
+def describe_format(f):
+    kind = "audio" if f.get('vcodec') == 'none' else "audio+vidéo"
+    abr = f"{f['abr']:.0f}k" if f.get('abr') else "?k"
+    return f"{f.get('format_id', '?')} {f.get('acodec') or '?'} {abr} ({kind})"
+
+def pick_audio_url(data):
+    audio_format = pick_audio_format(data)
+    return audio_format.get("url") if audio_format else None
+
+def stream_expiry(audio_url):
+    # Les URLs signées portent leur expiration : ?expire=... (googlevideo),
+    # /expire/.../ ou ?Expires=... (SoundCloud / CloudFront)
+    if not audio_url:
+        return None
+    parsed = urlparse(audio_url)
+    params = parse_qs(parsed.query)
+    expire = (params.get("expire") or params.get("Expires") or [None])[0]
+    if expire is None:
+        parts = parsed.path.split("/")
+        if "expire" in parts[:-1]:
+            expire = parts[parts.index("expire") + 1]
+    try:
+        return int(expire)
+    except (TypeError, ValueError):
+        return None
+
+# Champs conservés d'un résultat yt-dlp
+INFO_FIELDS = ("id", "title", "thumbnail", "uploader", "duration", "extractor_key", "webpage_url", "url", "acodec")
+FORMAT_FIELDS = ("format_id", "url", "acodec", "vcodec", "abr", "ext", "protocol")
+# Champs d'une piste sauvegardés (les URL audio expirent, elles sont résolues à nouveau)
+TRACK_SNAPSHOT_FIELDS = ("title", "artist", "duration", "thumbnail", "source", "url", "query", "spotify_id", "isrc")
+
+def trim_info(data):
+    if not data:
+        return None
+    if 'entries' in data:
+        entries = [e for e in data['entries'] if e]
+        if not entries:
+            return None
+        data = entries[0]
+
+    trimmed = {k: data[k] for k in INFO_FIELDS if data.get(k) is not None}
+    if data.get('formats'):
+        trimmed['formats'] = [
+            {k: f[k] for k in FORMAT_FIELDS if f.get(k) is not None}
+            for f in data['formats']
+            if f.get('acodec') != 'none'
+        ]
+    return trimmed
+
+# Entrées d'une playlist non résolue (url + ce qui est déjà connu)
+def trim_entries(data):
+    if not data or 'entries' not in data:
+        return None
+    return [
+        {k: e[k] for k in ("url", "title", "duration") if e.get(k) is not None}
+        for e in data['entries']
+        if e and e.get('url')
+    ]
+
+# Base SQLite d'un cache ou d'un index : ouverte au premier accès, sous self.lock, car les
+# workers d'extraction (spawn) réimportent ce fichier sans jamais s'en servir
+class SQLiteStore:
+    # Tables et index à créer, puis colonnes ajoutées après coup : (table, colonne, type)
+    schema = ()
+    added_columns = ()
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = None
+
+    @property
+    def db(self):
+        if self.connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False)
+            for statement in self.schema:
+                db.execute(statement)
+            for table, column, kind in self.added_columns:
+                if column not in {row[1] for row in db.execute(f"PRAGMA table_info({table})")}:
+                    db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {kind}")
+            db.commit()
+            self.connection = db
+        return self.connection
+
+class ResolverCache(SQLiteStore):
+    schema = ("CREATE TABLE IF NOT EXISTS resolved (key TEXT PRIMARY KEY, expires REAL, data TEXT)",)
+
+    def __init__(self, path, max_entries, default_ttl):
+        # Niveau mémoire (LRU) : uniquement manipulé depuis la boucle asyncio
+        self.memory = OrderedDict()
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        # Niveau disque : uniquement manipulé depuis les threads d'extraction
+        super().__init__(path)
+        self.puts = 0
+
+    def expiry_for(self, data):
+        expire = stream_expiry(pick_audio_url(data))
+        if expire:
+            return expire - STREAM_EXPIRY_MARGIN
+        return time.time() + self.default_ttl
+
+    def get(self, key):
+        entry = self.memory.get(key)
+        if entry is None:
+            return None
+        expires, data = entry
+        if expires <= time.time():
+            del self.memory[key]
+            return None
+        self.memory.move_to_end(key)
+        return data
+
+    def remember(self, key, expires, data):
+        self.memory[key] = (expires, data)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def get_disk(self, key):
+        if not self.path:
+            return None
+        with self.lock:
+            row = self.db.execute("SELECT expires, data FROM resolved WHERE key = ?", (key,)).fetchone()
+        if row is None or row[0] <= time.time():
+            return None
+        return row[0], json.loads(row[1])
+
+    def put_disk(self, key, expires, data):
+        if not self.path:
+            return
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO resolved (key, expires, data) VALUES (?, ?, ?)",
+                (key, expires, json.dumps(data)),
+            )
+            # Purge à la première écriture puis régulièrement : sinon la base grossit
+            # d'une entrée par recherche tant que le bot tourne
+            if self.puts % RESOLVER_CACHE_PURGE_EVERY == 0:
+                self.db.execute("DELETE FROM resolved WHERE expires <= ?", (time.time(),))
+            self.puts += 1
+            self.db.commit()
+
+resolver_cache = ResolverCache(
+    os.path.join(CACHE_DIR, "resolver.sqlite3") if RESOLVER_CACHE_DISK else None,
+    RESOLVER_CACHE_SIZE,
+    RESOLVER_CACHE_TTL,
+)
+
+async def extract_info(query, *, loop=None):
+    loop = loop or asyncio.get_event_loop()
+    key = normalize_query(query)
+    data = resolver_cache.get(key)
+    if data is not None:
+        return data
+
+    cached = await loop.run_in_executor(None, resolver_cache.get_disk, key)
+    if cached:
+        expires, data = cached
+    else:
+        data = await extraction_pool.extract(query, loop=loop)
+        if data is None:
+            return None
+        expires = resolver_cache.expiry_for(data)
+        await loop.run_in_executor(None, resolver_cache.put_disk, key, expires, data)
+    resolver_cache.remember(key, expires, data)
+    return data
+
+# Piste de la file : uniquement les champs dont le bot se sert
+class Track:
+    __slots__ = (
+        "title", "artist", "duration", "thumbnail", "source", "url", "query",
+        "audio_url", "acodec", "format_note", "expires", "media_id", "spotify_id", "isrc", "resume_at",
+    )
+
+    def __init__(self, title=None, *, artist=None, duration=None, thumbnail=None, source="yt",
+                 url=None, query=None, spotify_id=None, isrc=None):
+        self.title = title
+        self.artist = artist
+        self.duration = duration
+        self.thumbnail = thumbnail
+        self.source = source
+        self.url = url
+        self.query = query
+        self.audio_url = None
+        self.acodec = None
+        self.format_note = None
+        self.expires = 0
+        # Identifiant stable de la piste, ex. "youtube:dQw4w9WgXcQ"
+        self.media_id = None
+        self.spotify_id = spotify_id
+        self.isrc = isrc
+        # Position de reprise en secondes (file restaurée), lue une seule fois au démarrage
+        self.resume_at = 0
 
     @classmethod
-    async def from_url(cls, url, *, loop=None, volume=1.0):
-        loop = loop or asyncio.get_event_loop()
+    def from_info(cls, info, *, url=None, target_kbps=None):
+        extractor = info.get("extractor_key", "").lower()
+        track = cls(
+            info.get("title", url),
+            url=info.get("webpage_url") or url,
+            source="soundcloud" if "soundcloud" in extractor else "yt",
+        )
+        track.apply(info, target_kbps)
+        return track
+
+    # Résultat d'extraction → flux audio choisi (+ métadonnées manquantes)
+    def apply(self, info, target_kbps=None):
+        audio_format = pick_audio_format(info, target_kbps) or {}
+        self.audio_url = audio_format.get("url")
+        self.acodec = audio_format.get("acodec")
+        self.format_note = describe_format(audio_format) if audio_format.get("format_id") else None
+        self.expires = resolver_cache.expiry_for(info)
+        if info.get("extractor_key") and info.get("id"):
+            self.media_id = f"{info['extractor_key'].lower()}:{info['id']}"
+        self.title = self.title or info.get("title")
+        self.artist = self.artist or info.get("uploader")
+        self.duration = self.duration or info.get("duration")
+        self.thumbnail = self.thumbnail or info.get("thumbnail")
+
+    def is_resolved(self):
+        return bool(self.audio_url) and self.expires > time.time()
+
+    def to_snapshot(self):
+        return {f: getattr(self, f) for f in TRACK_SNAPSHOT_FIELDS if getattr(self, f) is not None}
+
+    @classmethod
+    def from_snapshot(cls, data):
+        return cls(data.get("title"), **{f: data[f] for f in TRACK_SNAPSHOT_FIELDS[1:] if f in data})
+
+# Identifiant stable, connu sans extraction pour les liens YouTube
+def track_media_id(track):
+    if track.media_id:
+        return track.media_id
+    if track.url:
+        normalized = normalize_query(track.url)
+        if normalized.startswith("youtube.com/watch?v="):
+            return "youtube:" + normalized.split("=", 1)[1]
+    return None
+
+# Cache disque de l'audio déjà encodé en Opus, limité en taille (éviction LRU).
+# Rempli en tâche de fond après la première lecture d'une piste.
+class AudioCache:
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total = 0
+        self.filling = set()
+        self.loaded = False
+
+    # Dossier parcouru au premier accès, jamais à l'import (workers d'extraction)
+    def load(self):
+        if self.loaded:
+            return
+        self.loaded = True
+        os.makedirs(self.directory, exist_ok=True)
 
-        # Extraire les infos avec yt-dlp
+        # Ordre LRU reconstruit depuis la date de dernière utilisation des fichiers
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".part"):
+                os.remove(path)
+            elif name.endswith(".ogg"):
+                stat = os.stat(path)
+                files.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(files):
+            self.entries[key] = size
+            self.total += size
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".ogg")
+
+    def key_for(self, track):
+        media_id = track_media_id(track)
+        return hashlib.sha1(media_id.encode()).hexdigest() if media_id else None
+
+    def lookup(self, track):
+        self.load()
+        key = self.key_for(track)
+        if key not in self.entries:
+            return None
+        path = self.path(key)
         try:
-            data = await loop.run_in_executor(None, lambda: ytdl.extract_info(url, download=False))
-        except Exception as e:
-            raise RuntimeError(f"Erreur yt-dlp : {e}")
+            os.utime(path)
+        except OSError:
+            self.total -= self.entries.pop(key)
+            return None
+        self.entries.move_to_end(key)
+        return path
 
-        if not data:
-            raise RuntimeError("yt-dlp n'a rien retourné")
-
-        if 'entries' in data:
-            data = data['entries'][0]
-
-        # Pour SoundCloud, récupérer le format audio direct
-        formats = data.get('formats')
-        audio_url = None
-        if formats:
-            for f in formats:
-                if f.get('acodec') != 'none':
-                    audio_url = f.get('url')
-                    break
-        else:
-            audio_url = data.get("url")
+    # Clé à remplir pendant la lecture de la piste, ou None (déjà en cache, trop longue...)
+    def begin_fill(self, track):
+        self.load()
+        key = self.key_for(track)
+        if not key or key in self.entries or key in self.filling:
+            return None
+        if not track.duration or track.duration > AUDIO_CACHE_MAX_TRACK_SECONDS:
+            return None
+        self.filling.add(key)
+        return key
+
+    # Fin de la lecture : le fichier n'est gardé que si la piste a été lue en entier
+    def end_fill(self, key, complete):
+        self.filling.discard(key)
+        path = self.path(key)
+        part = path + ".part"
+        try:
+            if not complete:
+                if os.path.exists(part):
+                    os.remove(part)
+                return
+            os.replace(part, path)
+            size = os.path.getsize(path)
+        except OSError as e:
+            print(f"⚠️ Cache audio : {e}")
+            return
+        self.entries[key] = size
+        self.total += size
+        self.evict()
+
+    def evict(self):
+        while self.total > self.max_bytes and len(self.entries) > 1:
+            key, size = self.entries.popitem(last=False)
+            self.total -= size
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
+
+# En cluster, un dossier par processus : aucun ne supprime les fichiers qu'un autre lit ou écrit
+AUDIO_CACHE_DIR = os.path.join(CACHE_DIR, "audio", f"cluster-{CLUSTER_ID}") if CLUSTER_ID is not None else os.path.join(CACHE_DIR, "audio")
+audio_cache = AudioCache(AUDIO_CACHE_DIR, AUDIO_CACHE_MAX_MB * 1024 * 1024) if AUDIO_CACHE else None
 
-        if not audio_url:
+# Démarrage à une position (en secondes) pour la reprise après redémarrage
+def seek_options(before_options, start):
+    return f"{before_options} -ss {start:.0f}" if start else before_options
+
+# Classe YTDLSource
+class YTDLSource(discord.PCMVolumeTransformer):
+    def __init__(self, source, *, track, volume=1.0):
+        super().__init__(source, volume)
+        self.track = track
+        self.title = track.title
+
+    # Construit la source directement depuis une piste déjà résolue
+    # (ou depuis le cache audio local quand la piste y est)
+    @classmethod
+    def from_track(cls, track, *, volume=1.0, start=0):
+        if PLAYBACK_MODE == "opus":
+            return YTDLOpusSource.from_track(track, volume=volume, start=start)
+
+        local_path = audio_cache.lookup(track) if audio_cache else None
+        if not local_path and not track.audio_url:
             raise RuntimeError("Impossible d'obtenir l'URL audio pour FFmpeg")
 
         ffmpeg_path = find_ffmpeg()
         source = discord.FFmpegPCMAudio(
-            audio_url,
+            local_path or track.audio_url,
             executable=ffmpeg_path,
-            before_options="-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5 -nostdin",
+            before_options=seek_options("-nostdin" if local_path else FFMPEG_BEFORE_OPTIONS, start),
             options="-vn"
         )
-        return cls(source, data=data, volume=volume)
+        return cls(source, track=track, volume=volume)
+
+# Flux Ogg lu par discord.py, recopié au passage dans un fichier du cache audio
+class CacheTee:
+    def __init__(self, stream, key, part, loop):
+        self.stream = stream
+        self.key = key
+        self.loop = loop
+        self.file = open(part, "wb")
+        self.eof = False
+
+    def read(self, n):
+        data = self.stream.read(n)
+        if not data:
+            self.eof = True
+        elif self.file:
+            try:
+                self.file.write(data)
+            except OSError as e:
+                print(f"⚠️ Cache audio : écriture impossible : {e}")
+                self.file.close()
+                self.file = None
+        return data
+
+    # Appelé depuis le thread de lecture de discord.py
+    def finish(self, exited_ok):
+        complete = self.file is not None and self.eof and exited_ok
+        if self.file:
+            self.file.close()
+        try:
+            self.loop.call_soon_threadsafe(audio_cache.end_fill, self.key, complete)
+        except RuntimeError:
+            pass
+
+# Opus produit par ffmpeg : pas de PCM ni d'encodage côté Python.
+# Un flux déjà en Opus est copié tel quel, le volume passe par un filtre ffmpeg.
+class YTDLOpusSource(discord.FFmpegOpusAudio):
+    def __init__(self, audio_url, *, track, codec=None, volume=1.0, before_options=FFMPEG_BEFORE_OPTIONS):
+        options = "-vn"
+        if volume != 1.0:
+            options += f" -filter:a volume={volume}"
+        super().__init__(
+            audio_url,
+            bitrate=OPUS_BITRATE,
+            codec=codec,
+            executable=find_ffmpeg(),
+            before_options=before_options,
+            options=options
+        )
+        self.track = track
+        self.title = track.title
+        self.volume = volume
+        self.fill = None
+
+    # La lecture remplit le cache : la piste n'est téléchargée qu'une fois
+    def tee_to_cache(self):
+        key = audio_cache.begin_fill(self.track)
+        if key is None:
+            return
+        try:
+            self.fill = CacheTee(self._stdout, key, audio_cache.path(key) + ".part", asyncio.get_event_loop())
+        except OSError as e:
+            print(f"⚠️ Cache audio : {e}")
+            audio_cache.end_fill(key, False)
+            return
+        self._packet_iter = OggStream(self.fill).iter_packets()
+
+    def cleanup(self):
+        fill, self.fill = getattr(self, "fill", None), None
+        process = getattr(self, "_process", None)
+        super().cleanup()
+        if fill:
+            fill.finish(bool(process) and process.returncode == 0)
+
+    @classmethod
+    def from_track(cls, track, *, volume=1.0, start=0):
+        # Le cache audio contient toujours de l'Opus
+        local_path = audio_cache.lookup(track) if audio_cache else None
+        if local_path:
+            codec = "opus" if volume == 1.0 else None
+            return cls(local_path, track=track, codec=codec, volume=volume,
+                       before_options=seek_options("-nostdin", start))
+
+        if not track.audio_url:
+            raise RuntimeError("Impossible d'obtenir l'URL audio pour FFmpeg")
+
+        # codec "opus" = copie du flux ; sinon ffmpeg encode en libopus
+        codec = "opus" if track.acodec == "opus" and volume == 1.0 else None
+        source = cls(track.audio_url, track=track, codec=codec, volume=volume,
+                     before_options=seek_options(FFMPEG_BEFORE_OPTIONS, start))
+        if audio_cache and not start and volume == 1.0:
+            source.tee_to_cache()
+        return source
 
 def is_spotify_url(url: str) -> bool:
     return "spotify.com" in url
@@ -103,86 +816,740 @@ def is_spotify_url(url: str) -> bool:
 def is_soundcloud_url(url: str) -> bool:
     return "soundcloud.com" in url or "snd.sc" in url
 
-# Spotify → pistes
-async def spotify_to_tracks(url: str):
-    if sp is None:
-        return None
+def is_soundcloud_set(url: str) -> bool:
+    return is_soundcloud_url(url) and "/sets/" in url
+
+# Set SoundCloud → pistes résolues seulement au moment de les jouer
+async def soundcloud_set_tracks(url: str):
+    entries = await extraction_pool.extract(url, flat=True)
+    return [
+        Track(e.get("title"), url=e["url"], duration=e.get("duration"), source="soundcloud")
+        for e in entries or []
+    ]
+
+def spotify_track(track, thumbnail=None):
+    images = (track.get("album") or {}).get("images")
+    return Track(
+        track["name"],
+        query=f"{track['name']} {track['artists'][0]['name']}",
+        artist=track["artists"][0]["name"],
+        thumbnail=thumbnail or (images[0]["url"] if images else None),
+        duration=track.get("duration_ms", 0) // 1000,
+        source="spotify",
+        spotify_id=track.get("id"),
+        isrc=(track.get("external_ids") or {}).get("isrc"),
+    )
+
+# Parcourt toutes les pages (champ "next") en chargeant la suivante
+# pendant que la page courante est traitée
+async def spotify_pages(page):
+    while page:
+        next_page = asyncio.create_task(spotify_call(spotify_client().next, page)) if page.get("next") else None
+        try:
+            yield page
+        except GeneratorExit:
+            if next_page:
+                next_page.cancel()
+            raise
+        page = await next_page if next_page else None
 
-    results = []
+# Spotify → pistes, page par page
+async def spotify_iter_tracks(url: str):
     if "track" in url:
-        track = sp.track(url)
-        results.append({
-            "query": f"{track['name']} {track['artists'][0]['name']}",
-            "title": track["name"],
-            "artist": track["artists"][0]["name"],
-            "thumbnail": (track["album"]["images"][0]["url"] if track["album"]["images"] else None),
-            "duration": track["duration_ms"] // 1000,
-            "source": "spotify",
-        })
+        track = await spotify_call(spotify_client().track, url)
+        yield [spotify_track(track)]
     elif "album" in url:
-        album = sp.album(url)
+        album = await spotify_call(spotify_client().album, url)
         album_thumb = album["images"][0]["url"] if album["images"] else None
-        for t in album["tracks"]["items"]:
-            results.append({
-                "query": f"{t['name']} {t['artists'][0]['name']}",
-                "title": t["name"],
-                "artist": t["artists"][0]["name"],
-                "thumbnail": album_thumb,
-                "duration": t.get("duration_ms", 0) // 1000,
-                "source": "spotify",
-            })
+        async for page in spotify_pages(album["tracks"]):
+            yield [spotify_track(t, album_thumb) for t in page["items"]]
     elif "playlist" in url:
-        playlist = sp.playlist(url)
-        for item in playlist["tracks"]["items"]:
-            track = item.get("track")
-            if not track:
-                continue
-            results.append({
-                "query": f"{track['name']} {track['artists'][0]['name']}",
-                "title": track["name"],
-                "artist": track["artists"][0]["name"],
-                "thumbnail": (track["album"]["images"][0]["url"] if track["album"]["images"] else None),
-                "duration": track.get("duration_ms", 0) // 1000,
-                "source": "spotify",
-            })
-    return results
+        playlist = await spotify_call(spotify_client().playlist, url)
+        async for page in spotify_pages(playlist["tracks"]):
+            yield [spotify_track(item["track"]) for item in page["items"] if item.get("track")]
+
+# Index local Spotify (id / ISRC) → vidéo YouTube
+class MatchIndex(SQLiteStore):
+    schema = (
+        "CREATE TABLE IF NOT EXISTS matches ("
+        "spotify_id TEXT PRIMARY KEY, isrc TEXT, video_id TEXT NOT NULL, "
+        "confidence REAL, duration_delta INTEGER, updated REAL)",
+        "CREATE INDEX IF NOT EXISTS matches_isrc ON matches (isrc)",
+    )
+    added_columns = (("matches", "title", "TEXT"),)
+
+    def lookup(self, spotify_id, isrc=None):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT video_id FROM matches WHERE spotify_id = ? AND confidence >= ?",
+                (spotify_id, MATCH_MIN_CONFIDENCE),
+            ).fetchone()
+            if row is None and isrc:
+                row = self.db.execute(
+                    "SELECT video_id FROM matches WHERE isrc = ? AND confidence >= ? "
+                    "ORDER BY confidence DESC LIMIT 1",
+                    (isrc, MATCH_MIN_CONFIDENCE),
+                ).fetchone()
+        return row[0] if row else None
+
+    def record(self, spotify_id, isrc, video_id, confidence, duration_delta, title=None):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO matches "
+                "(spotify_id, isrc, video_id, confidence, duration_delta, updated, title) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (spotify_id, isrc, video_id, confidence, duration_delta, time.time(), title),
+            )
+            self.db.commit()
+
+match_index = MatchIndex(os.path.join(CACHE_DIR, "spotify_matches.sqlite3"))
+
+# Score entre 0 et 1 : mots du titre/artiste retrouvés et écart de durée
+def match_confidence(track, data):
+    expected = f"{track.title or ''} {track.artist or ''}".lower().split()
+    found = f"{data.get('title', '')} {data.get('uploader', '')}".lower()
+    words = sum(1 for w in expected if w in found) / len(expected) if expected else 0
+    similarity = difflib.SequenceMatcher(None, (track.title or "").lower(), data.get("title", "").lower()).ratio()
+    delta = abs((data.get("duration") or 0) - (track.duration or 0))
+    timing = max(0.0, 1 - max(0, delta - 3) / 30)
+    return round(0.5 * words + 0.2 * similarity + 0.3 * timing, 3), delta
+
+def format_duration(seconds):
+    seconds = int(seconds or 0)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+def progress_bar(elapsed, duration, size=16):
+    if not duration:
+        return f"🔴 {format_duration(elapsed)}"
+    filled = min(size - 1, int(elapsed / duration * size))
+    bar = "▬" * filled + "🔘" + "▬" * (size - filled - 1)
+    return f"{bar}\n{format_duration(elapsed)} / {format_duration(duration)}"
+
+def track_query(track):
+    return track.url or track.query or track.title
+
+# Premier résultat d'une piste Spotify illisible (vidéo supprimée, bloquée...) :
+# essaie les résultats suivants, du plus ressemblant au moins ressemblant
+async def search_fallback(track, failed_url, loop):
+    try:
+        entries = await extraction_pool.extract(
+            f"ytsearch{SEARCH_FALLBACK_RESULTS}:{track.query}", flat=True, loop=loop
+        )
+    except Exception:
+        return None
+    entries = entries or []
+    if failed_url is None:
+        # Recherche directe : le premier résultat est celui qui vient d'échouer
+        entries = entries[1:]
+    candidates = [e for e in entries if e["url"] != failed_url]
+    candidates.sort(key=lambda e: match_confidence(track, e)[0], reverse=True)
+    for entry in candidates:
+        try:
+            data = await extract_info(entry["url"], loop=loop)
+        except Exception:
+            continue
+        if data:
+            track.url = data.get("webpage_url") or entry["url"]
+            return data
+    return None
+
+# Résout une piste de la file (recherche comprise) et garde le résultat dessus
+async def resolve_track(track, target_kbps=None, *, use_cache=True):
+    if track.is_resolved():
+        return
+    loop = asyncio.get_event_loop()
+
+    # Piste Spotify déjà associée à une vidéo : pas de recherche
+    searched = False
+    if track.spotify_id and not track.url:
+        video_id = await loop.run_in_executor(None, match_index.lookup, track.spotify_id, track.isrc)
+        if video_id:
+            track.url = f"https://www.youtube.com/watch?v={video_id}"
+        else:
+            searched = True
+
+    # Piste présente dans le cache audio : ni extraction ni flux distant
+    if use_cache and audio_cache and audio_cache.lookup(track):
+        return
+
+    try:
+        data = await extract_info(track_query(track), loop=loop)
+        error = None if data else "yt-dlp n'a rien retourné"
+    except Exception as e:
+        data, error = None, f"Erreur yt-dlp : {e}"
+    if not data and track.spotify_id and track.query:
+        data = await search_fallback(track, track.url, loop)
+        searched = searched or data is not None
+    if not data:
+        raise RuntimeError(error)
+    track.apply(data, target_kbps)
+
+    if searched and data.get("id") and data.get("extractor_key") == "Youtube":
+        confidence, delta = match_confidence(track, data)
+        await loop.run_in_executor(
+            None, match_index.record, track.spotify_id, track.isrc, data["id"], confidence, delta,
+            f"{track.title} - {track.artist}" if track.artist else track.title
+        )
+
+# Identité d'une piste pour repérer les doublons
+def track_key(track):
+    if track.spotify_id:
+        return f"spotify:{track.spotify_id}"
+    return normalize_query(track_query(track) or "")
+
+# File d'attente : deque (retrait en tête en O(1)) + index des pistes par identité
+class TrackQueue:
+    def __init__(self):
+        self.tracks = deque()
+        self.keys = Counter()
+        self.duplicates = 0
+        # Durée totale (s) et durée comptée pour chaque piste
+        self.duration = 0
+        self.counted = {}
+        # Pistes retirées en tête depuis la création (position absolue de la tête)
+        self.popped = 0
+        # Incrémentée à chaque modification autre qu'un ajout en fin ou un retrait en tête
+        self.edits = 0
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def __iter__(self):
+        return iter(self.tracks)
+
+    def __getitem__(self, index):
+        return self.tracks[index]
+
+    def _index(self, track):
+        key = track_key(track)
+        if self.keys[key]:
+            self.duplicates += 1
+        self.keys[key] += 1
+        self.counted[id(track)] = track.duration or 0
+        self.duration += self.counted[id(track)]
+
+    def _unindex(self, track):
+        key = track_key(track)
+        self.keys[key] -= 1
+        if self.keys[key]:
+            self.duplicates -= 1
+        else:
+            del self.keys[key]
+        self.duration -= self.counted.pop(id(track), 0)
+
+    def head(self, count):
+        return list(islice(self.tracks, count))
+
+    def page(self, start, count):
+        return list(islice(self.tracks, start, start + count))
+
+    def append(self, track):
+        self.tracks.append(track)
+        self._index(track)
+
+    def extend(self, tracks):
+        for track in tracks:
+            self.append(track)
+
+    def appendleft(self, track):
+        self.tracks.appendleft(track)
+        self._index(track)
+        self.edits += 1
+
+    def popleft(self):
+        track = self.tracks.popleft()
+        self._unindex(track)
+        self.popped += 1
+        return track
+
+    def clear(self):
+        self.edits += 1
+        self.tracks.clear()
+        self.keys.clear()
+        self.duplicates = 0
+        self.duration = 0
+        self.counted.clear()
+
+    def remove(self, index):
+        track = self.tracks[index]
+        del self.tracks[index]
+        self._unindex(track)
+        self.edits += 1
+        return track
+
+    def move(self, src, dst):
+        track = self.tracks[src]
+        del self.tracks[src]
+        self.tracks.insert(dst, track)
+        self.edits += 1
+        return track
+
+    def shuffle(self):
+        tracks = list(self.tracks)
+        random.shuffle(tracks)
+        self.tracks = deque(tracks)
+        self.edits += 1
+
+    # Durée connue seulement après la résolution (Spotify, sets SoundCloud...)
+    def refresh(self, track):
+        if id(track) in self.counted:
+            duration = track.duration or 0
+            self.duration += duration - self.counted[id(track)]
+            self.counted[id(track)] = duration
+
+    # Retire les pistes situées avant index
+    def jump(self, index):
+        for _ in range(index):
+            self.popleft()
+
+    # Garde la première occurrence de chaque piste
+    def dedupe(self):
+        if not self.duplicates:
+            return 0
+        seen = set()
+        kept = deque()
+        for track in self.tracks:
+            key = track_key(track)
+            if key not in seen:
+                seen.add(key)
+                kept.append(track)
+            else:
+                self.duration -= self.counted.pop(id(track), 0)
+        removed = len(self.tracks) - len(kept)
+        self.tracks = kept
+        self.keys = Counter(seen)
+        self.duplicates = 0
+        self.edits += 1
+        return removed
+
+# Limite d'envoi de Discord par salon : OUTBOX_BURST messages par OUTBOX_WINDOW secondes
+OUTBOX_BURST = 5
+OUTBOX_WINDOW = 5.0
+# Un message resté plus longtemps en file est compté comme retardé
+OUTBOX_DELAYED_AFTER = 1.0
+DISCORD_MESSAGE_LIMIT = 2000
+
+class OutboundMessage:
+    __slots__ = ("send", "content", "kwargs", "key", "futures", "queued_at")
+
+    def __init__(self, send, content, kwargs, key, future):
+        self.send = send
+        self.content = content
+        self.kwargs = kwargs
+        self.key = key
+        self.futures = [future]
+        self.queued_at = time.monotonic()
+
+# Envois sortants : une file par salon vidée par une tâche en arrière-plan.
+# Les commandes n'attendent plus les pauses de rate limit de discord.py ;
+# les suivis d'interaction ont leur propre tâche et n'attendent jamais le salon, et les
+# notifications rapprochées de même type sont fusionnées en un seul message.
+class Outbox:
+    def __init__(self, max_pending):
+        self.max_pending = max_pending
+        # id du salon -> (suivis d'interaction, messages ordinaires)
+        self.queues = {}
+        # (id du salon, urgent) -> tâche qui vide la file correspondante
+        self.workers = {}
+        # id du salon -> heures des derniers envois ordinaires
+        self.history = {}
+        self.sent = 0
+        self.merged = 0
+        self.dropped = 0
+        self.delayed = 0
+
+    async def send(self, channel, content=None, *, key=None, wait=False, **kwargs):
+        future = self.enqueue(channel.id, channel.send, content, kwargs, key=key)
+        return await future if wait else None
+
+    async def respond(self, interaction, content=None, *, wait=False, **kwargs):
+        # Première réponse : envoyée tout de suite, Discord l'exige sous 3 s
+        if not interaction.response.is_done():
+            await interaction.response.send_message(content, **kwargs)
+            self.sent += 1
+            return None
+        future = self.enqueue(interaction.channel_id, interaction.followup.send, content, kwargs, urgent=True)
+        return await future if wait else None
+
+    # Les modifications sont comptées et limitées comme les envois, sans clé : jamais abandonnées
+    async def edit(self, message, *, wait=False, **kwargs):
+        future = self.enqueue(message.channel.id, functools.partial(self.edit_message, message), None, kwargs)
+        return await future if wait else None
+
+    # False si le message a été supprimé entre-temps
+    @staticmethod
+    async def edit_message(message, **kwargs):
+        try:
+            await message.edit(**kwargs)
+        except discord.NotFound:
+            return False
+        return True
+
+    def enqueue(self, channel_id, send, content, kwargs, *, key=None, urgent=False):
+        future = asyncio.get_event_loop().create_future()
+        urgent_queue, normal_queue = self.queues.setdefault(channel_id, (deque(), deque()))
+        queue = urgent_queue if urgent else normal_queue
+        last = queue[-1] if queue else None
+        if (key and last and last.key == key and content and not kwargs and not last.kwargs
+                and len(last.content) + len(content) < DISCORD_MESSAGE_LIMIT):
+            last.content += "\n" + content
+            last.futures.append(future)
+            self.merged += 1
+        else:
+            # Seules les notifications (messages avec une clé) peuvent être abandonnées :
+            # réponses aux commandes, file d'attente, "lecture en cours"... partent toujours
+            if not urgent and len(normal_queue) >= self.max_pending:
+                dropped = next((m for m in normal_queue if m.key), None)
+                if dropped:
+                    normal_queue.remove(dropped)
+                    for f in dropped.futures:
+                        f.set_result(None)
+                    self.dropped += 1
+            queue.append(OutboundMessage(send, content, kwargs, key, future))
+        if (channel_id, urgent) not in self.workers:
+            self.workers[channel_id, urgent] = asyncio.create_task(self.drain(channel_id, urgent))
+        return future
+
+    async def drain(self, channel_id, urgent):
+        queue = self.queues[channel_id][0 if urgent else 1]
+        history = self.history.setdefault(channel_id, deque(maxlen=OUTBOX_BURST))
+        while queue:
+            # Les suivis passent par le webhook de l'interaction, hors limite du salon
+            if not urgent and len(history) == OUTBOX_BURST:
+                wait = history[0] + OUTBOX_WINDOW - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    continue
+            message = queue.popleft()
+            if not urgent:
+                history.append(time.monotonic())
+            await self.deliver(message)
+        del self.workers[channel_id, urgent]
+        if (channel_id, not urgent) not in self.workers:
+            del self.queues[channel_id]
+        asyncio.get_event_loop().call_later(OUTBOX_WINDOW, self.prune, channel_id)
+
+    # L'historique d'un salon n'est gardé que tant qu'il peut encore retarder un envoi
+    def prune(self, channel_id):
+        history = self.history.get(channel_id)
+        if (channel_id, False) in self.workers or history is None:
+            return
+        if not history or history[-1] + OUTBOX_WINDOW <= time.monotonic():
+            del self.history[channel_id]
+
+    async def deliver(self, message):
+        if time.monotonic() - message.queued_at > OUTBOX_DELAYED_AFTER:
+            self.delayed += 1
+        args = (message.content,) if message.content is not None else ()
+        try:
+            result = await message.send(*args, **message.kwargs)
+            self.sent += 1
+        except Exception:
+            # Salon supprimé, permissions manquantes... : la file continue
+            result = None
+        for future in message.futures:
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self):
+        return {
+            "sent": self.sent,
+            "merged": self.merged,
+            "dropped": self.dropped,
+            "delayed": self.delayed,
+            "pending": sum(len(u) + len(n) for u, n in self.queues.values()),
+        }
+
+outbox = Outbox(OUTBOX_MAX_PENDING)
 
 # MusicPlayer
 class MusicPlayer:
     def __init__(self, ctx):
         self.ctx = ctx
-        self.queue = []
-        self.playing = False
+        # Salon texte du serveur : reste valide après l'expiration des interactions
+        self.channel = ctx.channel
+        self.guild_id = ctx.guild.id
+        self.queue = TrackQueue()
+        self.last_active = time.monotonic()
+        self.closed = False
+        # Déconnexions programmées : "idle" / "empty" -> tâche
+        self.timers = {}
+        # Boucle de lecture du serveur : "idle" -> "resolving" -> "playing" -> "idle"...
+        self.state = "idle"
+        self.source = None
+        self.wakeup = asyncio.Event()
+        self.actor = None
+        # id(piste) -> (piste, tâche de résolution en cours)
+        self.prefetching = {}
+        # Piste en cours et chronologie de lecture (pauses déduites)
+        self.current = None
+        self.started_at = None
+        self.paused_at = None
+        self.paused_total = 0
+        # Message "Lecture en cours" unique, modifié sur place
+        self.now_playing_message = None
+        self.now_playing_task = None
+        self.now_playing_event = asyncio.Event()
+
+    @property
+    def playing(self):
+        return self.state != "idle"
+
+    # Débit du salon vocal en kbps, pour choisir le format audio
+    def target_bitrate(self):
+        vc = self.ctx.voice_client
+        if vc and vc.channel:
+            return vc.channel.bitrate // 1000
+        return None
+
+    # Résout les prochaines pistes pendant que la musique en cours joue
+    def prefetch(self):
+        upcoming = self.queue.head(PREFETCH_AHEAD)
+        upcoming_ids = {id(t) for t in upcoming}
+        for key in list(self.prefetching):
+            if key not in upcoming_ids:
+                self.prefetching.pop(key)[1].cancel()
+        target = self.target_bitrate()
+        for t in upcoming:
+            if id(t) not in self.prefetching:
+                self.prefetching[id(t)] = (t, asyncio.create_task(self.resolve(t, target)))
 
-    async def play_next(self):
-        if not self.queue or self.ctx.voice_client is None:
-            self.playing = False
+    async def resolve(self, track, target_kbps):
+        await resolve_track(track, target_kbps)
+        self.queue.refresh(track)
+
+    def cancel_prefetch(self):
+        for _, task in self.prefetching.values():
+            task.cancel()
+        self.prefetching.clear()
+
+    # Libère tout ce que le lecteur retient (tâches, file) ; il n'est plus utilisable ensuite
+    def close(self):
+        self.closed = True
+        self.cancel_prefetch()
+        self.queue.clear()
+        for task in (self.actor, self.now_playing_task, *self.timers.values()):
+            # La tâche qui ferme le lecteur (minuterie de déconnexion) doit aller au bout
+            if task and task is not asyncio.current_task():
+                task.cancel()
+        self.timers.clear()
+
+    def schedule_disconnect(self, kind, delay, message):
+        if self.closed or delay <= 0 or kind in self.timers:
             return
+        self.timers[kind] = asyncio.create_task(self.disconnect_later(kind, delay, message))
 
-        self.playing = True
-        track = self.queue.pop(0)
+    def cancel_disconnect(self, kind):
+        task = self.timers.pop(kind, None)
+        if task:
+            task.cancel()
 
-        url_to_play = track.get("url") or track.get("query") or track.get("title")
+    async def disconnect_later(self, kind, delay, message):
+        await asyncio.sleep(delay)
+        self.timers.pop(kind, None)
+        if players.get(self.guild_id) is self:
+            await evict_player(self.guild_id, message)
 
-        try:
-            player = await YTDLSource.from_url(url_to_play, volume=1.0)
-        except Exception as e:
-            await self.ctx.send(f"❌ Impossible de lire : {e}")
-            self.playing = False
-            await self.play_next()
+    def elapsed(self):
+        if self.started_at is None:
+            return 0
+        end = self.paused_at or time.monotonic()
+        return end - self.started_at - self.paused_total
+
+    def set_paused(self, paused):
+        now = time.monotonic()
+        if paused and self.paused_at is None:
+            self.paused_at = now
+        elif not paused and self.paused_at is not None:
+            self.paused_total += now - self.paused_at
+            self.paused_at = None
+        if paused:
+            self.schedule_disconnect("paused", PAUSE_TIMEOUT, "💤 Déconnecté après une longue pause.")
+        else:
+            self.cancel_disconnect("paused")
+        self.request_now_playing()
+
+    # Demande une mise à jour : les demandes rapprochées sont regroupées par la tâche du serveur
+    def request_now_playing(self):
+        self.now_playing_event.set()
+        if self.now_playing_task is None or self.now_playing_task.done():
+            self.now_playing_task = asyncio.create_task(self.now_playing_loop())
+
+    async def now_playing_loop(self):
+        while True:
+            self.now_playing_event.clear()
+            await self.update_now_playing()
+            if self.current is None:
+                return
+            # Au plus une édition par intervalle, même en cas de skips en rafale
+            await asyncio.sleep(NOW_PLAYING_DEBOUNCE)
+            if self.now_playing_event.is_set():
+                continue
+            # En pause (ou sans rafraîchissement), on attend le prochain changement
+            timeout = None
+            if NOW_PLAYING_REFRESH and not self.paused_at:
+                timeout = max(NOW_PLAYING_REFRESH, NOW_PLAYING_MIN_REFRESH) - NOW_PLAYING_DEBOUNCE
+            try:
+                await asyncio.wait_for(self.now_playing_event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def update_now_playing(self):
+        embed = self.now_playing_embed()
+        if self.now_playing_message is not None:
+            edited = await outbox.edit(self.now_playing_message, embed=embed, wait=True)
+            if edited is not False:
+                return
+            # Message supprimé : on en renvoie un nouveau
+            self.now_playing_message = None
+        if self.current is None:
+            return
+        self.now_playing_message = await outbox.send(self.channel, embed=embed, wait=True)
+
+    # Réveille la boucle de lecture : ajout dans la file, fin de piste, saut...
+    def wake(self):
+        if self.closed:
+            return
+        self.wakeup.set()
+        if self.actor is None or self.actor.done():
+            self.actor = asyncio.create_task(self.run())
+
+    # Une seule tâche par serveur fait avancer la lecture : pas de récursion
+    # après un échec, et deux ajouts simultanés ne lancent jamais deux lectures
+    async def run(self):
+        while not self.closed:
+            self.wakeup.clear()
+            if self.state == "idle":
+                if self.queue and self.ctx.voice_client is not None:
+                    await self.start_next()
+                    continue
+                self.finish()
+            await self.wakeup.wait()
+
+    # Appelé depuis le thread audio via call_soon_threadsafe
+    def track_finished(self, source):
+        if self.source is source:
+            self.source = None
+            self.state = "idle"
+            self.wake()
+
+    def finish(self):
+        if self.current is not None:
+            self.current = None
+            self.request_now_playing()
+        self.cancel_disconnect("paused")
+        self.schedule_disconnect("idle", IDLE_TIMEOUT, "💤 Déconnecté pour inactivité.")
+
+    # Tâche de résolution d'une piste : reprend la pré-résolution si elle n'a pas échoué
+    def resolution(self, track):
+        pending = self.prefetching.get(id(track))
+        if pending and not (pending[1].done() and (pending[1].cancelled() or pending[1].exception())):
+            return pending[1]
+        task = asyncio.create_task(self.resolve(track, self.target_bitrate()))
+        self.prefetching[id(track)] = (track, task)
+        return task
+
+    async def prepare(self, track):
+        while True:
+            task = self.resolution(track)
+            # asyncio.wait ne propage pas l'annulation de la tâche (fenêtre de prefetch déplacée)
+            await asyncio.wait([task])
+            if not task.cancelled():
+                break
+        if task.exception():
+            raise task.exception()
+        # Fichier du cache évincé depuis la résolution : extraction normale
+        if audio_cache and not track.audio_url and not audio_cache.lookup(track):
+            await resolve_track(track, self.target_bitrate(), use_cache=False)
+        # Réutilise l'extraction faite à l'ajout tant que l'URL audio est valide
+        return YTDLSource.from_track(track, volume=1.0, start=track.resume_at)
+
+    # Première piste jouable en tête de file. Après un échec, les pistes suivantes
+    # sont résolues en parallèle et la première qui réussit (dans l'ordre) est jouée.
+    async def next_playable(self, failed):
+        while self.queue and not self.closed:
+            candidates = self.queue.head(SKIP_AHEAD_PARALLEL if failed else 1)
+            for track in candidates:
+                self.resolution(track)
+            for track in candidates:
+                try:
+                    source = await self.prepare(track)
+                    error = None
+                except Exception as e:
+                    source, error = None, e
+                # La file a pu changer pendant l'attente (remove, jump, clear...) :
+                # le ffmpeg déjà lancé pour cette piste est arrêté
+                if not self.queue or self.queue[0] is not track:
+                    if source is not None:
+                        source.cleanup()
+                    break
+                self.queue.popleft()
+                self.prefetching.pop(id(track), None)
+                if error is None:
+                    return track, source
+                failed.append((track, error))
+        return None, None
+
+    async def report_failures(self, failed):
+        lines = [f"• **{t.title or 'Titre inconnu'}** : {str(e)[:100]}" for t, e in failed[:10]]
+        if len(failed) > 10:
+            lines.append(f"… et {len(failed) - 10} autres")
+        await outbox.send(self.channel, f"❌ Impossible de lire {len(failed)} piste(s) :\n" + "\n".join(lines), key="errors")
+
+    async def start_next(self):
+        self.state = "resolving"
+        self.last_active = time.monotonic()
+        self.cancel_disconnect("idle")
+        self.cancel_disconnect("paused")
+        failed = []
+        track, source = await self.next_playable(failed)
+        if failed:
+            # Un seul message pour toutes les pistes sautées
+            asyncio.create_task(self.report_failures(failed))
+
+        vc = self.ctx.voice_client
+        if track is None or vc is None or self.closed:
+            if source is not None:
+                # Connexion vocale perdue pendant la résolution : ffmpeg arrêté, piste remise en tête
+                source.cleanup()
+                if not self.closed:
+                    self.queue.appendleft(track)
+            self.state = "idle"
             return
 
+        loop = asyncio.get_running_loop()
+
         def after(_):
-            coro = self.play_next()
-            asyncio.run_coroutine_threadsafe(coro, bot.loop)
+            loop.call_soon_threadsafe(self.track_finished, source)
 
-        self.ctx.voice_client.play(player, after=after)
+        self.source = source
+        self.state = "playing"
+        vc.play(source, after=after)
+        self.prefetch()
+
+        self.current = track
+        self.started_at = time.monotonic() - track.resume_at
+        track.resume_at = 0
+        self.paused_at = None
+        self.paused_total = 0
+        self.request_now_playing()
+
+    def now_playing_embed(self):
+        track = self.current
+        if track is None:
+            embed = discord.Embed(title="⏹️ Lecture terminée", description="La file est vide.", color=0x5865F2)
+            embed.set_footer(text="🎧 nom_de_ton_bot")
+            return embed
 
         # Couleurs embed
-        if track.get("source") == "spotify":
+        if track.source == "spotify":
             color = 0x1DB954
             source_label = "Spotify"
-        elif track.get("source") == "soundcloud":
+        elif track.source == "soundcloud":
             color = 0xFF7700
             source_label = "SoundCloud"
         else:
@@ -190,76 +1557,406 @@ class MusicPlayer:
             source_label = "YouTube"
 
         embed = discord.Embed(
-            title="🎵 Lecture en cours",
-            description=f"**{track.get('title', player.title)}**",
+            title="⏸️ En pause" if self.paused_at else "🎵 Lecture en cours",
+            description=f"**{track.title or 'Titre inconnu'}**",
             color=color
         )
 
-        thumb = track.get("thumbnail") or player.data.get("thumbnail")
+        thumb = track.thumbnail
         if thumb:
             embed.set_thumbnail(url=thumb)
 
-        artist = track.get("artist") or player.data.get("uploader")
+        artist = track.artist
         if artist:
             embed.add_field(name="👤 Artiste", value=artist, inline=True)
 
-        duration_val = track.get("duration") or player.data.get("duration")
+        duration_val = track.duration
         if duration_val:
             minutes = int(duration_val // 60)
             seconds = int(duration_val % 60)
             embed.add_field(name="⏱️ Durée", value=f"{minutes}:{seconds:02d}", inline=True)
 
         embed.add_field(name="🔗 Source", value=source_label, inline=True)
-        embed.set_footer(text="🎧 nom_de_ton_bot")
-        await self.ctx.send(embed=embed)
+        # Sans rafraîchissement périodique, la barre resterait figée : affichée seulement en pause
+        if NOW_PLAYING_REFRESH or self.paused_at:
+            embed.add_field(name="▶️ Progression", value=progress_bar(self.elapsed(), duration_val), inline=False)
+        # Format audio choisi à la résolution (absent quand la piste vient du cache audio)
+        if track.format_note:
+            embed.set_footer(text=f"🎧 nom_de_ton_bot · {track.format_note}")
+        else:
+            embed.set_footer(text="🎧 nom_de_ton_bot")
+        return embed
+
+    # Ajout groupé (imports de playlists) : un seul passage, aucun message par piste
+    async def add_many(self, tracks):
+        if not tracks:
+            return 0, 0
+        self.queue.extend(tracks)
+        self.prefetch()
+        self.wake()
+        return len(tracks), sum(t.duration or 0 for t in tracks)
 
     async def add_to_queue(self, item):
-        if isinstance(item, dict):  
+        if isinstance(item, Track):
             track = item
         else:
             loop = asyncio.get_event_loop()
             try:
-                data = await loop.run_in_executor(None, lambda: ytdl.extract_info(item, download=False))
-                if "entries" in data:
-                    data = data["entries"][0]
-                title = data.get("title", item)
-                thumb = data.get("thumbnail")
-                uploader = data.get("uploader")
-                duration = data.get("duration")
-                extractor = data.get("extractor_key", "").lower()
+                data = await extract_info(item, loop=loop)
+                track = Track.from_info(data, url=item, target_kbps=self.target_bitrate())
             except Exception:
-                title, thumb, uploader, duration, extractor = item, None, None, None, ""
-
-            source = "soundcloud" if "soundcloud" in extractor else "yt"
-
-            track = {
-                "url": item,
-                "title": title,
-                "thumbnail": thumb,
-                "artist": uploader,
-                "duration": duration,
-                "source": source,
-            }
+                track = Track(item, url=item)
 
+        self.queue.append(track)
         if self.playing:
-            self.queue.append(track)
-            await self.ctx.send(f"➕ Ajouté à la file : **{track['title']}**")
-        else:
-            self.queue.append(track)
-            await self.play_next()
+            self.prefetch()
+            await outbox.send(self.channel, f"➕ Ajouté à la file : **{track.title}**", key="added")
+        self.wake()
 
 players = {}
 def get_player(ctx):
     if ctx.guild.id not in players:
+        make_room()
         players[ctx.guild.id] = MusicPlayer(ctx)
-    return players[ctx.guild.id]
+    player = players[ctx.guild.id]
+    player.last_active = time.monotonic()
+    return player
+
+class PlayerLimitReached(Exception):
+    pass
+
+# Plafond MAX_PLAYERS : libère le lecteur inactif le plus ancien, sinon refuse
+def make_room():
+    if MAX_PLAYERS <= 0 or len(players) < MAX_PLAYERS:
+        return
+    idle = [p for p in players.values() if not p.playing]
+    if not idle:
+        raise PlayerLimitReached()
+    oldest = min(idle, key=lambda p: p.last_active)
+    evict_player(oldest.guild_id, "💤 Déconnecté pour libérer de la place.")
+
+# Retire le lecteur tout de suite ; la déconnexion vocale se fait dans une tâche
+def evict_player(guild_id, message=None):
+    player = players.pop(guild_id, None)
+    if player:
+        player.close()
+    return asyncio.create_task(release_voice(guild_id, player, message))
+
+async def release_voice(guild_id, player, message):
+    guild = bot.get_guild(guild_id)
+    if guild and guild.voice_client:
+        await guild.voice_client.disconnect(force=True)
+    if player and message:
+        await outbox.send(player.channel, message)
+
+# Lecteurs dont le serveur a disparu ou qui n'ont plus de connexion vocale
+async def sweep_players():
+    while True:
+        await asyncio.sleep(PLAYER_SWEEP_INTERVAL)
+        now = time.monotonic()
+        for guild_id, player in list(players.items()):
+            guild = bot.get_guild(guild_id)
+            if guild is None:
+                evict_player(guild_id)
+            elif guild.voice_client is None and not player.playing and now - player.last_active > PLAYER_SWEEP_INTERVAL:
+                evict_player(guild_id)
+
+player_sweeper = None
+
+# (shard, latence en secondes, nombre de serveurs) pour chaque shard de ce processus
+def shard_status():
+    guilds = Counter(g.shard_id for g in bot.guilds)
+    if isinstance(bot, commands.AutoShardedBot):
+        latencies = bot.latencies
+    else:
+        latencies = [(bot.shard_id or 0, bot.latency)]
+    return [(shard_id, latency, guilds[shard_id]) for shard_id, latency in latencies]
+
+def format_latency(latency):
+    # Latence inconnue tant que le premier heartbeat n'a pas eu lieu
+    if latency != latency or latency == float("inf"):
+        return "—"
+    return f"{latency * 1000:.0f} ms"
+
+QUEUE_PAGE_SIZE = 10
+
+# File d'attente paginée : un seul message, pages générées à la demande
+class QueueView(discord.ui.View):
+    def __init__(self, player):
+        super().__init__(timeout=180)
+        self.player = player
+        self.page = 0
+        self.message = None
+
+    def page_count(self):
+        return max(1, -(-len(self.player.queue) // QUEUE_PAGE_SIZE))
+
+    def render(self):
+        queue = self.player.queue
+        self.page = min(self.page, self.page_count() - 1)
+        start = self.page * QUEUE_PAGE_SIZE
+
+        embed = discord.Embed(
+            title="📜 File d'attente",
+            color=0x5865F2,
+            description=f"**{len(queue)}** pistes · ⏱️ {format_duration(queue.duration)} restantes\n\n"
+        )
+        tracks = queue.page(start, QUEUE_PAGE_SIZE)
+        for i, track in enumerate(tracks, start + 1):
+            title = (track.title or "Titre inconnu")[:80]
+            artist = track.artist or "Artiste inconnu"
+            duration_str = format_duration(track.duration) if track.duration else "❓"
+            if track.source == "spotify":
+                source_label = "Spotify"
+            elif track.source == "soundcloud":
+                source_label = "SoundCloud"
+            else:
+                source_label = "YouTube/Recherche"
+            embed.description += f"**{i}. {title}**\n👤 {artist} | ⏱️ {duration_str} | 🔗 {source_label}\n\n"
+
+        thumb = tracks[0].thumbnail if tracks else None
+        if thumb:
+            embed.set_thumbnail(url=thumb)
+
+        self.previous_page.disabled = self.page == 0
+        self.next_page.disabled = self.page >= self.page_count() - 1
+        embed.set_footer(text=f"🎧 File d'attente de nom_de_ton_bot · page {self.page + 1}/{self.page_count()}")
+        return embed
+
+    @discord.ui.button(emoji="◀️", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page = max(0, self.page - 1)
+        await interaction.response.edit_message(embed=self.render(), view=self)
+
+    @discord.ui.button(emoji="▶️", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page += 1
+        await interaction.response.edit_message(embed=self.render(), view=self)
+
+    async def on_timeout(self):
+        if self.message:
+            try:
+                await self.message.edit(view=None)
+            except discord.HTTPException:
+                pass
+
+# Sauvegarde des files
+# Dernier état des files, écrit par lots dans une seule transaction hors de la boucle asyncio
+class QueueSnapshots(SQLiteStore):
+    schema = (
+        "CREATE TABLE IF NOT EXISTS snapshots ("
+        "guild_id INTEGER PRIMARY KEY, text_channel_id INTEGER, voice_channel_id INTEGER, "
+        "current TEXT, position REAL, updated REAL)",
+        "CREATE TABLE IF NOT EXISTS snapshot_tracks ("
+        "guild_id INTEGER, position INTEGER, data TEXT, PRIMARY KEY (guild_id, position))",
+    )
+
+    # batch : (serveur, salon texte, salon vocal, piste en cours, position, changements de la file ou None)
+    # changements : (réécriture complète, position de la tête, position de la première piste écrite, pistes)
+    def write(self, batch, removed):
+        with self.lock:
+            for guild_id, text_id, voice_id, current, position, delta in batch:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?, ?, ?)",
+                    (guild_id, text_id, voice_id, json.dumps(current) if current else None, position, time.time()),
+                )
+                if delta is not None:
+                    full, head, first, tracks = delta
+                    if full:
+                        self.db.execute("DELETE FROM snapshot_tracks WHERE guild_id = ?", (guild_id,))
+                    else:
+                        # Pistes jouées depuis la dernière sauvegarde
+                        self.db.execute(
+                            "DELETE FROM snapshot_tracks WHERE guild_id = ? AND position < ?", (guild_id, head)
+                        )
+                    self.db.executemany(
+                        "INSERT OR REPLACE INTO snapshot_tracks VALUES (?, ?, ?)",
+                        ((guild_id, first + i, json.dumps(t)) for i, t in enumerate(tracks)),
+                    )
+            for guild_id in removed:
+                self.db.execute("DELETE FROM snapshots WHERE guild_id = ?", (guild_id,))
+                self.db.execute("DELETE FROM snapshot_tracks WHERE guild_id = ?", (guild_id,))
+            self.db.commit()
+
+    def delete(self, guild_id):
+        self.write([], [guild_id])
+
+    def load(self):
+        with self.lock:
+            snapshots = {
+                guild_id: {
+                    "text_channel_id": text_id,
+                    "voice_channel_id": voice_id,
+                    "current": json.loads(current) if current else None,
+                    "position": position or 0,
+                    "updated": updated or 0,
+                    "tracks": [],
+                }
+                for guild_id, text_id, voice_id, current, position, updated in self.db.execute(
+                    "SELECT guild_id, text_channel_id, voice_channel_id, current, position, updated FROM snapshots"
+                )
+            }
+            for guild_id, data in self.db.execute(
+                "SELECT guild_id, data FROM snapshot_tracks ORDER BY guild_id, position"
+            ):
+                if guild_id in snapshots:
+                    snapshots[guild_id]["tracks"].append(json.loads(data))
+        return snapshots
+
+queue_snapshots = QueueSnapshots(os.path.join(CACHE_DIR, "queues.sqlite3"))
+
+# Sauvegarde périodique : seuls les serveurs dont la file ou la position a changé sont écrits,
+# et seulement ce qui a changé (têtes jouées supprimées, ajouts écrits à la suite)
+async def snapshot_players():
+    loop = asyncio.get_event_loop()
+    # id du serveur -> (modifications de la file, tête, fin, piste en cours) déjà enregistrées
+    saved = {}
+    while True:
+        await asyncio.sleep(SNAPSHOT_INTERVAL)
+        removed = []
+        for guild_id in list(saved):
+            player = players.get(guild_id)
+            if player is None or (not player.queue and player.current is None):
+                # Arrêté, expulsé ou file terminée : rien à reprendre
+                removed.append(guild_id)
+                del saved[guild_id]
+        batch = []
+        for guild_id, player in list(players.items()):
+            guild = bot.get_guild(guild_id)
+            vc = guild.voice_client if guild else None
+            if vc is None or vc.channel is None or (not player.queue and player.current is None):
+                continue
+            current = player.current
+            queue = player.queue
+            state = (queue.edits, queue.popped, queue.popped + len(queue), id(current))
+            last = saved.get(guild_id)
+            if last is None or last[0] != queue.edits:
+                # Première sauvegarde ou file réordonnée : réécrite en entier
+                delta = (True, queue.popped, queue.popped, [t.to_snapshot() for t in queue])
+            elif last[1:3] != state[1:3]:
+                first = max(last[2], queue.popped)
+                delta = (False, queue.popped, first,
+                         [t.to_snapshot() for t in islice(queue.tracks, first - queue.popped, None)])
+            else:
+                delta = None
+            if delta is None and last[3] == state[3] and (current is None or player.paused_at):
+                continue
+            batch.append((
+                guild_id, player.channel.id, vc.channel.id,
+                current.to_snapshot() if current else None,
+                player.elapsed() if current else 0,
+                delta,
+            ))
+            saved[guild_id] = state
+        if batch or removed:
+            try:
+                await loop.run_in_executor(None, queue_snapshots.write, batch, removed)
+            except sqlite3.Error as e:
+                print(f"⚠️ Sauvegarde des files impossible : {e}")
+                # Changements perdus : les files seront réécrites en entier la prochaine fois
+                saved.clear()
+
+# Remplace ctx / interaction pour un lecteur recréé sans commande
+class RestoredContext:
+    def __init__(self, guild, channel):
+        self.guild = guild
+        self.channel = channel
+
+    @property
+    def voice_client(self):
+        return self.guild.voice_client
+
+async def restore_player(guild, snapshot):
+    voice = guild.get_channel(snapshot["voice_channel_id"])
+    text = guild.get_channel(snapshot["text_channel_id"])
+    if voice is None or text is None or guild.id in players:
+        return False
+    try:
+        make_room()
+        if guild.voice_client is None:
+            await voice.connect()
+    except Exception:
+        return False
+    player = MusicPlayer(RestoredContext(guild, text))
+    players[guild.id] = player
+    tracks = [Track.from_snapshot(data) for data in snapshot["tracks"]]
+    if snapshot["current"]:
+        track = Track.from_snapshot(snapshot["current"])
+        # Reprend là où la piste s'était arrêtée, sauf si elle était presque finie
+        if not track.duration or snapshot["position"] < track.duration - 5:
+            track.resume_at = snapshot["position"]
+        tracks.insert(0, track)
+    await player.add_many(tracks)
+    await outbox.send(text, f"♻️ File restaurée : **{len(tracks)}** pistes.")
+    return True
+
+class RestoreView(discord.ui.View):
+    def __init__(self, guild, snapshot):
+        super().__init__(timeout=600)
+        self.guild = guild
+        self.snapshot = snapshot
+        self.message = None
+
+    @discord.ui.button(label="Reprendre", emoji="▶️", style=discord.ButtonStyle.success)
+    async def resume_queue(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.stop()
+        await interaction.response.edit_message(view=None)
+        if not await restore_player(self.guild, self.snapshot):
+            await outbox.send(interaction.channel, "⚠️ Impossible de restaurer la file.")
+
+    @discord.ui.button(label="Ignorer", emoji="🗑️", style=discord.ButtonStyle.secondary)
+    async def discard_queue(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.stop()
+        await interaction.response.edit_message(content="🗑️ File précédente ignorée.", view=None)
+        if self.guild.id not in players:
+            await asyncio.get_event_loop().run_in_executor(None, queue_snapshots.delete, self.guild.id)
+
+    # Sans réponse : la file n'est plus proposée aux redémarrages suivants
+    async def on_timeout(self):
+        if self.guild.id not in players:
+            await asyncio.get_event_loop().run_in_executor(None, queue_snapshots.delete, self.guild.id)
+        if self.message:
+            try:
+                await self.message.edit(view=None)
+            except discord.HTTPException:
+                pass
+
+# Au-delà, une file interrompue n'est plus proposée (serveur quitté, salon supprimé...)
+SNAPSHOT_MAX_AGE = 24 * 3600
+
+async def restore_queues():
+    loop = asyncio.get_event_loop()
+    snapshots = await loop.run_in_executor(None, queue_snapshots.load)
+    for guild_id, snapshot in snapshots.items():
+        if time.time() - snapshot["updated"] > SNAPSHOT_MAX_AGE:
+            await loop.run_in_executor(None, queue_snapshots.delete, guild_id)
+            continue
+        # Serveur d'un autre shard / cluster : laissé à son processus
+        guild = bot.get_guild(guild_id)
+        if guild is None:
+            continue
+        if RESTORE_QUEUES == "auto":
+            await restore_player(guild, snapshot)
+            continue
+        text = guild.get_channel(snapshot["text_channel_id"])
+        if text is None:
+            continue
+        count = len(snapshot["tracks"]) + (1 if snapshot["current"] else 0)
+        view = RestoreView(guild, snapshot)
+        view.message = await outbox.send(
+            text, f"♻️ Une file de **{count}** pistes a été interrompue par un redémarrage.", view=view, wait=True
+        )
+
+queue_snapshotter = None
 
 # ===== COMMANDES =====
 @bot.command(help="🔊 Joue une musique ou l'ajoute à la file d'attente")
 async def play(ctx, *, url: str):
     if ctx.author.voice is None:
-        return await ctx.send("⚠️ Tu dois être dans un salon vocal !")
+        return await outbox.send(ctx.channel, "⚠️ Tu dois être dans un salon vocal !")
 
+    # Lecteur créé avant la connexion : si MAX_PLAYERS est atteint, le bot ne rejoint pas le salon
+    get_player(ctx)
     channel = ctx.author.voice.channel
     if ctx.voice_client is None:
         await channel.connect()
@@ -268,16 +1965,38 @@ async def play(ctx, *, url: str):
 
     # Spotify
     if is_spotify_url(url):
-        tracks = await spotify_to_tracks(url)
-        if tracks is None:
-            return await ctx.send("⚠️ Identifiants Spotify manquants dans .env")
-        if not tracks:
-            return await ctx.send("⚠️ Impossible de lire le lien Spotify.")
-        for t in tracks:
-            await get_player(ctx).add_to_queue(t)
+        if spotify_client() is None:
+            return await outbox.send(ctx.channel, "⚠️ Identifiants Spotify manquants dans .env")
+        # La lecture démarre dès la première page, les suivantes arrivent ensuite
+        player = get_player(ctx)
+        was_playing = player.playing
+        total, duration, first_title = 0, 0, None
+        async for tracks in spotify_iter_tracks(url):
+            if tracks and first_title is None:
+                first_title = tracks[0].title
+            added, seconds = await player.add_many(tracks)
+            total += added
+            duration += seconds
+        if not total:
+            return await outbox.send(ctx.channel, "⚠️ Impossible de lire le lien Spotify.")
+        if total > 1:
+            await outbox.send(ctx.channel, f"➕ **{total}** pistes ajoutées à la file (⏱️ {format_duration(duration)})", key="added")
+        elif was_playing:
+            await outbox.send(ctx.channel, f"➕ Ajouté à la file : **{first_title}**", key="added")
         return
 
     # SoundCloud
+    if is_soundcloud_set(url):
+        try:
+            tracks = await soundcloud_set_tracks(url)
+        except Exception:
+            tracks = []
+        if not tracks:
+            return await outbox.send(ctx.channel, "⚠️ Impossible de lire le set SoundCloud.")
+        total, duration = await get_player(ctx).add_many(tracks)
+        await outbox.send(ctx.channel, f"➕ **{total}** pistes ajoutées à la file (⏱️ {format_duration(duration)})", key="added")
+        return
+
     if is_soundcloud_url(url):
         await get_player(ctx).add_to_queue(url)
         return
@@ -291,81 +2010,133 @@ async def skip(ctx):
     vc = ctx.voice_client
     if vc and vc.is_playing():
         vc.stop()
-        await ctx.send("⏭️ Musique passée !")
+        await outbox.send(ctx.channel, "⏭️ Musique passée !")
     else:
-        await ctx.send("⚠️ Aucune musique à skip.")
+        await outbox.send(ctx.channel, "⚠️ Aucune musique à skip.")
 
 @bot.command(help="⏸️ Met la musique en pause")
 async def pause(ctx):
     vc = ctx.voice_client
     if vc and vc.is_playing():
         vc.pause()
-        await ctx.send("⏸️ Musique mise en pause.")
+        if ctx.guild.id in players:
+            players[ctx.guild.id].set_paused(True)
+        await outbox.send(ctx.channel, "⏸️ Musique mise en pause.")
     else:
-        await ctx.send("⚠️ Pas de musique à mettre en pause.")
+        await outbox.send(ctx.channel, "⚠️ Pas de musique à mettre en pause.")
 
 @bot.command(help="▶️ Reprend la musique en pause")
 async def resume(ctx):
     vc = ctx.voice_client
     if vc and vc.is_paused():
         vc.resume()
-        await ctx.send("▶️ Musique reprise.")
+        if ctx.guild.id in players:
+            players[ctx.guild.id].set_paused(False)
+        await outbox.send(ctx.channel, "▶️ Musique reprise.")
     else:
-        await ctx.send("⚠️ Aucune musique en pause.")
+        await outbox.send(ctx.channel, "⚠️ Aucune musique en pause.")
 
 @bot.command(help="📜 Affiche la file d'attente")
 async def queue(ctx):
     player = get_player(ctx)
     if not player.queue:
-        return await ctx.send("📭 La file est vide.")
+        return await outbox.send(ctx.channel, "📭 La file est vide.")
 
-    for i, track in enumerate(player.queue, 1):
-        title = track.get("title", "Titre inconnu")
-        artist = track.get("artist")
-        thumb = track.get("thumbnail")
-        duration_val = track.get("duration")
-
-        if track.get("source") == "spotify":
-            color = 0x1DB954
-            source_label = "Spotify"
-        elif track.get("source") == "soundcloud":
-            color = 0xFF7700
-            source_label = "SoundCloud"
-        else:
-            color = 0xFF0000
-            source_label = "YouTube/Recherche"
-
-        embed = discord.Embed(
-            title=f"{i}. 🎶 {title}",
-            color=color
-        )
-        if thumb:
-            embed.set_thumbnail(url=thumb)
-        if artist:
-            embed.add_field(name="👤 Artiste", value=artist, inline=True)
-        if duration_val:
-            minutes = int(duration_val // 60)
-            seconds = int(duration_val % 60)
-            embed.add_field(name="⏱️ Durée", value=f"{minutes}:{seconds:02d}", inline=True)
-
-        embed.add_field(name="🔗 Source", value=source_label, inline=True)
-        embed.set_footer(text="🎧 File d'attente de nom_de_ton_bot")
-        await ctx.send(embed=embed)
+    view = QueueView(player)
+    embed = view.render()
+    if view.page_count() == 1:
+        return await outbox.send(ctx.channel, embed=embed)
+    view.message = await outbox.send(ctx.channel, embed=embed, view=view, wait=True)
 
 @bot.command(help="🗑️ Vide la file d'attente")
 async def clear(ctx):
     player = get_player(ctx)
     player.queue.clear()
-    await ctx.send("🗑️ File d'attente vidée.")
+    player.cancel_prefetch()
+    await outbox.send(ctx.channel, "🗑️ File d'attente vidée.")
+
+@bot.command(help="❌ Retire une musique de la file : !remove <position>")
+async def remove(ctx, position: int):
+    player = get_player(ctx)
+    if not 1 <= position <= len(player.queue):
+        return await outbox.send(ctx.channel, "⚠️ Position invalide.")
+    track = player.queue.remove(position - 1)
+    player.prefetch()
+    await outbox.send(ctx.channel, f"❌ Retiré de la file : **{track.title or 'Titre inconnu'}**")
+
+@bot.command(help="↕️ Déplace une musique : !move <position> <nouvelle position>")
+async def move(ctx, position: int, new_position: int):
+    player = get_player(ctx)
+    size = len(player.queue)
+    if not (1 <= position <= size and 1 <= new_position <= size):
+        return await outbox.send(ctx.channel, "⚠️ Position invalide.")
+    track = player.queue.move(position - 1, new_position - 1)
+    player.prefetch()
+    await outbox.send(ctx.channel, f"↕️ **{track.title or 'Titre inconnu'}** déplacé en position {new_position}.")
+
+@bot.command(help="🔀 Mélange la file d'attente")
+async def shuffle(ctx):
+    player = get_player(ctx)
+    if not player.queue:
+        return await outbox.send(ctx.channel, "📭 La file est vide.")
+    player.queue.shuffle()
+    player.prefetch()
+    await outbox.send(ctx.channel, "🔀 File d'attente mélangée.")
+
+@bot.command(help="⏩ Passe directement à une musique de la file : !jump <position>")
+async def jump(ctx, position: int):
+    player = get_player(ctx)
+    if not 1 <= position <= len(player.queue):
+        return await outbox.send(ctx.channel, "⚠️ Position invalide.")
+    player.queue.jump(position - 1)
+    player.prefetch()
+    vc = ctx.voice_client
+    if vc and (vc.is_playing() or vc.is_paused()):
+        vc.stop()
+    else:
+        player.wake()
+    await outbox.send(ctx.channel, f"⏩ Saut à la position {position}.")
+
+@bot.command(help="🧹 Retire les doublons de la file")
+async def dedupe(ctx):
+    player = get_player(ctx)
+    removed = player.queue.dedupe()
+    player.prefetch()
+    await outbox.send(ctx.channel, f"🧹 {removed} doublon(s) retiré(s).")
 
 @bot.command(help="⏹️ Stoppe la musique et déconnecte le bot")
 async def stop(ctx):
     if ctx.voice_client:
-        players.pop(ctx.guild.id, None)
-        await ctx.voice_client.disconnect()
-        await ctx.send("⏹️ Déconnecté et file effacée.")
+        await evict_player(ctx.guild.id)
+        await outbox.send(ctx.channel, "⏹️ Déconnecté et file effacée.")
     else:
-        await ctx.send("⚠️ Le bot n'est pas connecté.")
+        await outbox.send(ctx.channel, "⚠️ Le bot n'est pas connecté.")
+
+@bot.command(help="📊 Affiche l'état du bot")
+async def stats(ctx):
+    embed = discord.Embed(title="📊 Statistiques", color=0x5865F2)
+    pool = extraction_pool.stats()
+    embed.add_field(
+        name=f"🧵 Extraction ({pool['backend']})",
+        value=(f"{pool['active']}/{pool['workers']} en cours · {pool['queued']} en attente\n"
+               f"{pool['done']} terminées · occupation {pool['utilization']:.0%}"),
+        inline=False
+    )
+    out = outbox.stats()
+    embed.add_field(
+        name="📨 Messages",
+        value=(f"{out['sent']} envoyés · {out['pending']} en attente\n"
+               f"{out['merged']} fusionnés · {out['delayed']} retardés · {out['dropped']} abandonnés"),
+        inline=False
+    )
+    shards = shard_status()
+    lines = [f"#{shard_id} · {format_latency(latency)} · {count} serveurs" for shard_id, latency, count in shards[:15]]
+    if len(shards) > 15:
+        lines.append(f"… et {len(shards) - 15} autres")
+    cluster = f"cluster {CLUSTER_ID} · " if CLUSTER_ID is not None else ""
+    embed.add_field(name=f"🛰️ Shards ({cluster}{len(bot.guilds)} serveurs · {len(players)} lecteurs)", value="\n".join(lines), inline=False)
+    embed.set_footer(text="🎧 nom_de_ton_bot")
+    await outbox.send(ctx.channel, embed=embed)
 
 @bot.command(help="❓ Affiche toutes les commandes disponibles")
 async def help(ctx):
@@ -378,16 +2149,182 @@ async def help(ctx):
         description = command.help if command.help else "Pas de description"
         embed.add_field(name=f"!{command.name}", value=description, inline=False)
     embed.set_footer(text="🎧 nom_de_ton_bot")
-    await ctx.send(embed=embed)
+    await outbox.send(ctx.channel, embed=embed)
+
+@bot.event
+async def on_shard_ready(shard_id):
+    print(f"🛰️ Shard {shard_id} prêt")
+
+@bot.event
+async def on_voice_state_update(member, before, after):
+    player = players.get(member.guild.id)
+    if player is None:
+        return
+    if member.id == bot.user.id and after.channel is None:
+        # Bot expulsé du salon ou connexion vocale perdue
+        evict_player(member.guild.id)
+        return
+    vc = member.guild.voice_client
+    if vc is None or vc.channel is None:
+        return
+    if any(not m.bot for m in vc.channel.members):
+        player.cancel_disconnect("empty")
+    else:
+        player.schedule_disconnect("empty", EMPTY_CHANNEL_TIMEOUT, "👋 Plus personne dans le salon vocal, déconnexion.")
+
+@bot.event
+async def on_command_error(ctx, error):
+    if isinstance(getattr(error, "original", error), PlayerLimitReached):
+        return await outbox.send(ctx.channel, "⚠️ Trop de serveurs écoutent de la musique en ce moment, réessaie plus tard.")
+    # Autres erreurs : comportement par défaut de discord.py
+    await commands.Bot.on_command_error(bot, ctx, error)
 
 @bot.event
 async def on_ready():
-    await bot.change_presence(
-        activity=discord.Activity(
-            type=discord.ActivityType.listening,
-            name="DJ Twahlett 🎧"
-        )
-    )
+    global player_sweeper, queue_snapshotter
+    if player_sweeper is None:
+        player_sweeper = asyncio.create_task(sweep_players())
+    if queue_snapshotter is None and RESTORE_QUEUES != "off":
+        queue_snapshotter = asyncio.create_task(snapshot_players())
+        asyncio.create_task(restore_queues())
     print(f"✅ Connecté en tant que {bot.user}")
 
-bot.run(TOKEN)
+# Cluster
+# Rapport d'état envoyé régulièrement au lanceur
+async def cluster_report(cluster_id, status_queue):
+    while True:
+        shards = shard_status()
+        latencies = [latency for _, latency, _ in shards if latency == latency and latency != float("inf")]
+        status_queue.put({
+            "cluster": cluster_id,
+            "pid": os.getpid(),
+            "time": time.time(),
+            "ready": bot.is_ready(),
+            "guilds": len(bot.guilds),
+            "players": len(players),
+            "playing": sum(1 for p in players.values() if p.playing),
+            "latency": sum(latencies) / len(latencies) if latencies else None,
+            "extraction": extraction_pool.stats()["utilization"],
+        })
+        await asyncio.sleep(CLUSTER_REPORT_INTERVAL)
+
+# Point d'entrée d'un processus du cluster : SHARD_COUNT / SHARD_IDS / CLUSTER_ID
+# sont posés par le lanceur avant le démarrage, le bot est donc déjà sharded
+def cluster_worker(cluster_id, status_queue):
+    extraction_pool.start()
+    discord.utils.setup_logging()
+
+    async def main():
+        async with bot:
+            asyncio.create_task(cluster_report(cluster_id, status_queue))
+            await bot.start(TOKEN)
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+
+# Lanceur : un processus par groupe de shards, relancé s'il plante ou ne répond plus.
+# Un processus qui tombe n'entraîne pas les autres (chacun a ses lecteurs et sa connexion).
+class ClusterLauncher:
+    def __init__(self, shard_count, shard_ids, processes):
+        self.shard_count = shard_count
+        processes = max(1, min(processes, len(shard_ids)))
+        self.groups = [shard_ids[i * len(shard_ids) // processes:(i + 1) * len(shard_ids) // processes]
+                       for i in range(processes)]
+        # Les workers ne sont pas daemon : ils lancent eux-mêmes des processus d'extraction
+        self.context = multiprocessing.get_context("spawn")
+        self.status_queue = self.context.Queue()
+        self.workers = {}
+        self.started = {}
+        self.reports = {}
+        self.restarts = Counter()
+        self.pending = deque(range(processes))
+        self.next_start = 0
+        self.next_summary = 0
+
+    def spawn(self, cluster_id):
+        shards = self.groups[cluster_id]
+        # Le processus lancé (spawn) relit la configuration dans l'environnement
+        os.environ["SHARD_COUNT"] = str(self.shard_count)
+        os.environ["SHARD_IDS"] = ",".join(map(str, shards))
+        os.environ["CLUSTER_ID"] = str(cluster_id)
+        process = self.context.Process(
+            target=cluster_worker,
+            args=(cluster_id, self.status_queue),
+            name=f"cluster-{cluster_id}"
+        )
+        process.start()
+        self.workers[cluster_id] = process
+        self.started[cluster_id] = time.monotonic()
+        self.reports.pop(cluster_id, None)
+        print(f"🚀 Cluster {cluster_id} lancé (pid {process.pid}, shards {shards[0]}-{shards[-1]})")
+
+    def collect(self, timeout):
+        try:
+            status = self.status_queue.get(timeout=timeout)
+        except Empty:
+            return
+        status["received"] = time.monotonic()
+        self.reports[status["cluster"]] = status
+
+    def supervise(self):
+        now = time.monotonic()
+        for cluster_id, process in list(self.workers.items()):
+            last = self.reports.get(cluster_id, {}).get("received", self.started[cluster_id])
+            if process.is_alive() and now - last > CLUSTER_HEARTBEAT_TIMEOUT:
+                print(f"⚠️ Cluster {cluster_id} ne répond plus, arrêt forcé")
+                process.kill()
+                process.join(5)
+            if not process.is_alive():
+                print(f"💥 Cluster {cluster_id} arrêté (code {process.exitcode}), relance prévue")
+                del self.workers[cluster_id]
+                self.restarts[cluster_id] += 1
+                self.pending.append(cluster_id)
+        # Démarrages espacés : au plus un groupe de shards à la fois
+        if self.pending and now >= self.next_start:
+            cluster_id = self.pending.popleft()
+            self.spawn(cluster_id)
+            self.next_start = now + CLUSTER_START_DELAY * len(self.groups[cluster_id])
+        if now >= self.next_summary:
+            self.next_summary = now + 60
+            self.summary()
+
+    def summary(self):
+        for cluster_id in sorted(self.workers):
+            status = self.reports.get(cluster_id)
+            if not status:
+                print(f"📡 Cluster {cluster_id} : démarrage…")
+                continue
+            latency = f"{status['latency'] * 1000:.0f} ms" if status["latency"] is not None else "—"
+            print(f"📡 Cluster {cluster_id} : {status['guilds']} serveurs · {status['playing']}/{status['players']} lecteurs actifs"
+                  f" · {latency} · extraction {status['extraction']:.0%} · {self.restarts[cluster_id]} relance(s)")
+
+    def run(self):
+        try:
+            while True:
+                self.collect(timeout=1)
+                self.supervise()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for process in self.workers.values():
+                process.terminate()
+            for process in self.workers.values():
+                process.join(10)
+
+def run_cluster():
+    # "auto" demanderait à Discord un nombre que les processus ne connaissent pas encore
+    if SHARD_COUNT and not SHARD_COUNT.isdigit():
+        raise ValueError("❌ En cluster, SHARD_COUNT doit être un nombre (ou vide pour un shard par processus) !")
+    shard_count = int(SHARD_COUNT) if SHARD_COUNT else CLUSTER_PROCESSES
+    shard_ids = parse_shard_ids(SHARD_IDS) or list(range(shard_count))
+    ClusterLauncher(shard_count, shard_ids, CLUSTER_PROCESSES).run()
+
+# Garde nécessaire : les processus d'extraction et du cluster réimportent ce fichier
+if __name__ == "__main__":
+    if CLUSTER_PROCESSES > 1:
+        run_cluster()
+    else:
+        extraction_pool.start()
+        bot.run(TOKEN)
\ No newline at end of file